@@ -1,104 +1,254 @@
+import argparse
+import hashlib
 import oci
-import time
+import oci.exceptions
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from operator import attrgetter
 
-def choose_from_list(items, attr, prompt):
+def choose_from_list(items, attr, prompt, preselected=None, key='id'):
     """
     Presents a numbered list of options for the user to choose from.
     items: list of objects
     attr: attribute of the object to display (e.g. 'display_name')
     prompt: prompt text for input
+    preselected: value given on the command line; skips the prompt if set
+    key: attribute of the object that preselected is matched against
     Returns: the selected object
     """
-    for idx, item in enumerate(items):
-        print(f"[{idx}] {getattr(item, attr)}")
+    if preselected:
+        match = next((item for item in items if getattr(item, key) == preselected), None)
+        if not match:
+            print(f"{prompt}: '{preselected}' not found! Exiting.")
+            exit(1)
+        return match
+    get_label = attrgetter(attr)
+    sys.stdout.write("\n".join(f"[{idx}] {get_label(item)}" for idx, item in enumerate(items)) + "\n")
     choice = input(f"{prompt} [0-{len(items)-1}] (default 0): ").strip()
     idx = int(choice) if choice.isdigit() and int(choice) < len(items) else 0
     return items[idx]
 
+def write_lines(lines):
+    """
+    Writes a batch of log lines to stdout in a single write and flushes,
+    so messages from concurrent workers don't interleave line by line.
+    lines: list of strings without trailing newlines
+    """
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+@lru_cache(maxsize=None)
+def load_config():
+    """
+    Loads ~/.oci/config once per process; later calls return the cached dict.
+    """
+    return oci.config.from_file()
+
+@lru_cache(maxsize=None)
+def get_client(client_cls):
+    """
+    Returns a shared client of the given OCI client class, created on first
+    use and cached for the rest of the process. Only the main thread uses
+    these; background work builds its own client.
+    client_cls: e.g. oci.core.ComputeClient
+    """
+    return client_cls(load_config(), retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+
+def list_subnets_by_vcn(compartment_ocid):
+    """
+    Lists every subnet in a compartment with a single paginated call.
+    Uses a VirtualNetworkClient private to the calling thread.
+    compartment_ocid: compartment to search
+    Returns: dict mapping VCN OCID to the list of its subnets
+    """
+    vnet = oci.core.VirtualNetworkClient(load_config(), retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
+    subnets_by_vcn = {}
+    for subnet in oci.pagination.list_call_get_all_results(vnet.list_subnets, compartment_ocid).data:
+        subnets_by_vcn.setdefault(subnet.vcn_id, []).append(subnet)
+    return subnets_by_vcn
+
+def run_in_background(fn, *args):
+    """
+    Runs fn(*args) on a daemon thread, so an early exit() never waits for it.
+    Returns: a Future holding the result or the raised exception
+    """
+    future = Future()
+    def run():
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+# === Settings ===
+COMPARTMENT_NAME = 'tempcomp'
+COMPARTMENT_DESC = 'Temporary compartment created via script'
+INSTANCE_PREFIX = 'auto-win-instance'
+INSTANCE_COUNT = 4
+SHAPE = 'VM.Standard3.Flex'
+OCPUS = 54
+MEMORY_GBS = 512
+BOOT_VOL_GBS = 50
+IMAGE_LIST_LIMIT = 25
+
+# === Command-line options; anything not given is asked for interactively ===
+parser = argparse.ArgumentParser(description="Provision Windows compute instances in a temporary OCI compartment.")
+parser.add_argument("--parent-compartment", help="OCID of the compartment to create 'tempcomp' under (default: root)")
+parser.add_argument("--vcn-id", help="OCID of the VCN to use")
+parser.add_argument("--subnet-id", help="OCID of the subnet to use")
+parser.add_argument("--ad", help="name of the availability domain to use")
+parser.add_argument("--image-id", help="OCID of the Windows image to use")
+args = parser.parse_args()
+if not sys.stdin.isatty():
+    # Nothing to prompt on, so every choice must come from the command line
+    # (the VCN can be derived from --subnet-id)
+    missing = [flag for flag, value in (
+        ("--vcn-id", args.vcn_id or args.subnet_id),
+        ("--subnet-id", args.subnet_id),
+        ("--ad", args.ad),
+        ("--image-id", args.image_id),
+    ) if not value]
+    if missing:
+        parser.error(f"no terminal to prompt on; pass {', '.join(missing)}")
+
 # === OCI SDK Setup ===
 print("Loading OCI configuration and initializing clients...")
-config = oci.config.from_file()
-identity = oci.identity.IdentityClient(config)
-core = oci.core.ComputeClient(config)
-network = oci.core.VirtualNetworkClient(config)
+identity = get_client(oci.identity.IdentityClient)
+core = get_client(oci.core.ComputeClient)
+network = get_client(oci.core.VirtualNetworkClient)
 print("OCI clients initialized.\n")
 
 # === 1. Get your parent compartment OCID ===
 print("Step 1: Choose the compartment where the new compartment will be created.")
-use_root = input("Use root compartment? (y/n, default y): ").strip().lower()
+if args.parent_compartment:
+    use_root = "n"
+elif sys.stdin.isatty():
+    use_root = input("Use root compartment? (y/n, default y): ").strip().lower()
+else:
+    # Documented default of --parent-compartment
+    use_root = "y"
 if use_root == "n":
-    parent_compartment_ocid = input("Enter parent compartment OCID: ").strip()
+    parent_compartment_ocid = args.parent_compartment or input("Enter parent compartment OCID: ").strip()
     if not parent_compartment_ocid.startswith("ocid1.compartment."):
         print("Invalid OCID format! Exiting.")
         exit(1)
     print(f"Using provided compartment OCID: {parent_compartment_ocid}")
 else:
-    parent_compartment_ocid = config["tenancy"]
+    parent_compartment_ocid = load_config()["tenancy"]
     print(f"Using root compartment OCID: {parent_compartment_ocid}")
 
 # === 2. List VCNs and subnets in the parent compartment, and let user pick one ===
 print("\nStep 2: Retrieving VCNs in chosen compartment...")
-vnets = network.list_vcns(parent_compartment_ocid).data
+# Fetch the subnets in the background while VCNs are listed and chosen
+subnets_future = run_in_background(list_subnets_by_vcn, parent_compartment_ocid)
+
+vnets = oci.pagination.list_call_get_all_results(network.list_vcns, parent_compartment_ocid).data
 if not vnets:
     print("No VCNs found in chosen compartment! Exiting.")
     exit(1)
 print(f"Found {len(vnets)} VCN(s).")
-vcn = choose_from_list(vnets, 'display_name', "Select VCN")
+vcn_id = args.vcn_id
+if args.subnet_id and not vcn_id:
+    # The subnet determines its VCN
+    vcn_id = next((sn.vcn_id for sns in subnets_future.result().values() for sn in sns if sn.id == args.subnet_id), None)
+    if not vcn_id:
+        print(f"Select Subnet: '{args.subnet_id}' not found! Exiting.")
+        exit(1)
+vcn = choose_from_list(vnets, 'display_name', "Select VCN", vcn_id)
 print(f"Selected VCN: {vcn.display_name}")
 
-print("Retrieving subnets in the selected VCN...")
-subnets = network.list_subnets(parent_compartment_ocid, vcn_id=vcn.id).data
+subnets = subnets_future.result().get(vcn.id, [])
 if not subnets:
     print("No subnets found in selected VCN! Exiting.")
     exit(1)
 print(f"Found {len(subnets)} subnet(s).")
-subnet = choose_from_list(subnets, 'display_name', "Select Subnet")
+subnet = choose_from_list(subnets, 'display_name', "Select Subnet", args.subnet_id)
 subnet_id = subnet.id
 print(f"Selected Subnet: {subnet.display_name} (OCID: {subnet_id})")
 
 # === 3. List availability domains and let user pick one ===
 print("\nStep 3: Retrieving availability domains...")
-tenancy_id = config["tenancy"]
+tenancy_id = load_config()["tenancy"]
 ads = identity.list_availability_domains(tenancy_id).data
 print(f"Found {len(ads)} availability domain(s).")
-ad = choose_from_list(ads, 'name', "Select Availability Domain")
+ad = choose_from_list(ads, 'name', "Select Availability Domain", args.ad, key='name')
 ad_name = ad.name
 print(f"Selected Availability Domain: {ad_name}")
 
-# === 4. List all Windows images for the required shape and pick one ===
-print("\nStep 4: Searching for Windows images for shape VM.Standard3.Flex...")
-images = core.list_images(
-    compartment_id=parent_compartment_ocid,
-    operating_system="Windows",
-    shape="VM.Standard3.Flex"
-).data
-if not images:
-    print("No Windows images found for this shape! Exiting.")
+# Fail fast if the shape or its OCPU/memory sizing is not available here,
+# before anything is created
+print(f"Checking shape {SHAPE} availability in {ad_name}...")
+shapes = {s.shape: s for s in oci.pagination.list_call_get_all_results(
+    core.list_shapes,
+    parent_compartment_ocid,
+    availability_domain=ad_name
+).data}
+shape = shapes.get(SHAPE)
+if not shape:
+    print(f"Shape {SHAPE} is not available in {ad_name}! Exiting.")
+    exit(1)
+if shape.ocpu_options and OCPUS > shape.ocpu_options.max:
+    print(f"{OCPUS} OCPUs exceeds the {shape.ocpu_options.max} allowed for {SHAPE}! Exiting.")
     exit(1)
-print(f"Found {len(images)} Windows image(s). Sorting by most recent.")
-images.sort(key=lambda x: x.time_created, reverse=True)
-win_image = choose_from_list(images, 'display_name', "Select Windows Image")
+if shape.memory_options and MEMORY_GBS > shape.memory_options.max_in_g_bs:
+    print(f"{MEMORY_GBS} GB memory exceeds the {shape.memory_options.max_in_g_bs} GB allowed for {SHAPE}! Exiting.")
+    exit(1)
+print(f"Shape {SHAPE} supports {OCPUS} OCPUs / {MEMORY_GBS} GB memory.")
+
+# === 4. List the most recent Windows images for the required shape and pick one ===
+if args.image_id:
+    # An explicit image may be older than the newest IMAGE_LIST_LIMIT, so fetch it directly
+    print("\nStep 4: Retrieving the requested Windows image...")
+    try:
+        win_image = core.get_image(args.image_id).data
+    except oci.exceptions.ServiceError as e:
+        if e.status != 404:
+            raise
+        print(f"Select Windows Image: '{args.image_id}' not found! Exiting.")
+        exit(1)
+    if win_image.operating_system != "Windows":
+        print(f"Image '{win_image.display_name}' is {win_image.operating_system}, not Windows! Exiting.")
+        exit(1)
+    compatible_shapes = {entry.shape for entry in oci.pagination.list_call_get_all_results(
+        core.list_image_shape_compatibility_entries,
+        win_image.id
+    ).data}
+    if SHAPE not in compatible_shapes:
+        print(f"Image '{win_image.display_name}' is not compatible with shape {SHAPE}! Exiting.")
+        exit(1)
+else:
+    print(f"\nStep 4: Searching for Windows images for shape {SHAPE}...")
+    images = core.list_images(
+        compartment_id=parent_compartment_ocid,
+        operating_system="Windows",
+        shape=SHAPE,
+        sort_by="TIMECREATED",
+        sort_order="DESC",
+        limit=IMAGE_LIST_LIMIT
+    ).data
+    if not images:
+        print("No Windows images found for this shape! Exiting.")
+        exit(1)
+    print(f"Found {len(images)} Windows image(s), most recent first.")
+    win_image = choose_from_list(images, 'display_name', "Select Windows Image")
 win_image_id = win_image.id
 print(f"Selected Windows Image: {win_image.display_name} (OCID: {win_image_id})")
 
 # === 5. Check for an existing compartment named 'tempcomp' under the chosen compartment ===
-COMPARTMENT_NAME = 'tempcomp'
-COMPARTMENT_DESC = 'Temporary compartment created via script'
-INSTANCE_PREFIX = 'auto-win-instance'
-INSTANCE_COUNT = 4
-SHAPE = 'VM.Standard3.Flex'
-OCPUS = 54
-MEMORY_GBS = 512
-BOOT_VOL_GBS = 50
-
 print(f"\nStep 5: Checking if compartment '{COMPARTMENT_NAME}' exists under chosen compartment...")
-existing_compartments = identity.list_compartments(
+existing_compartments = oci.pagination.list_call_get_all_results(
+    identity.list_compartments,
     parent_compartment_ocid,
     compartment_id_in_subtree=False,
     access_level="ANY"
 ).data
 
-compartment = next((c for c in existing_compartments if c.name == COMPARTMENT_NAME and c.lifecycle_state != "DELETED"), None)
+named = [c for c in existing_compartments if c.name == COMPARTMENT_NAME]
+# Only an ACTIVE compartment is reused; a DELETING one can never become ACTIVE
+compartment = next((c for c in named if c.lifecycle_state == "ACTIVE"), None)
 
 if compartment:
     compartment_id = compartment.id
@@ -110,77 +260,138 @@ else:
             compartment_id=parent_compartment_ocid,
             name=COMPARTMENT_NAME,
             description=COMPARTMENT_DESC
-        )
+        ),
+        # A re-run replays the original create instead of conflicting with it.
+        # Earlier deleted copies are mixed in, so that after a delete the
+        # next run gets a fresh token rather than replaying the dead create.
+        opc_retry_token=hashlib.sha1(":".join(
+            [parent_compartment_ocid, COMPARTMENT_NAME]
+            + sorted(c.id for c in named if c.lifecycle_state in ("DELETED", "DELETING"))
+        ).encode()).hexdigest()
     ).data
     compartment_id = compartment.id
     print(f"Compartment '{COMPARTMENT_NAME}' created with OCID: {compartment_id}")
 
-# Wait until the compartment becomes ACTIVE, printing status each time
-import oci.exceptions
+# Wait until the compartment becomes ACTIVE
+# A freshly created compartment can return 404 for a short while, so treat
+# 404 as "not visible yet" and retry it alongside the usual throttling errors
+COMPARTMENT_GET_RETRY = oci.retry.RetryStrategyBuilder(
+    max_attempts_check=True,
+    max_attempts=10,
+    total_elapsed_time_check=True,
+    total_elapsed_time_seconds=30,
+    service_error_check=True,
+    service_error_retry_config={404: [], 409: ['IncorrectState'], 429: []},
+    service_error_retry_on_any_5xx=True
+).get_retry_strategy()
+
+def fetch_compartment(response=None):
+    return identity.get_compartment(compartment_id, retry_strategy=COMPARTMENT_GET_RETRY)
 
 print("Waiting for compartment to become ACTIVE (this may take up to 2 minutes)...")
-max_attempts = 30
-for i in range(max_attempts):
-    try:
-        comp = identity.get_compartment(compartment_id).data
-        print(f"Attempt {i+1}: Compartment lifecycle state is '{comp.lifecycle_state}'.")
-        if comp.lifecycle_state == 'ACTIVE':
-            print("Compartment is ACTIVE.")
-            break
-        else:
-            print("Still waiting for compartment to become ACTIVE...")
-    except oci.exceptions.ServiceError as e:
-        if e.status == 404:
-            print(f"Attempt {i+1}: Compartment not found yet; retrying...")
-        else:
-            print("Service error:", e)
-            raise
-    time.sleep(4)
-else:
+try:
+    oci.wait_until(
+        identity,
+        fetch_compartment(),
+        'lifecycle_state',
+        'ACTIVE',
+        max_wait_seconds=120,
+        max_interval_seconds=5,
+        fetch_func=fetch_compartment
+    )
+except oci.exceptions.MaximumWaitTimeExceeded:
     print("Compartment did not become ACTIVE in time. Exiting.")
     exit(1)
+except oci.exceptions.ServiceError as e:
+    if e.status != 404:
+        print("Service error:", e)
+        raise
+    print("Compartment never became visible. Exiting.")
+    exit(1)
+print("Compartment is ACTIVE.")
 
 # === 6. Launch the compute instances in the new compartment ===
-print(f"\nStep 6: Launching {INSTANCE_COUNT} Windows compute instances in compartment '{COMPARTMENT_NAME}'...")
-for idx in range(INSTANCE_COUNT):
+# Launch details shared by every instance; built once and reused
+launch_template = dict(
+    compartment_id=compartment_id,
+    availability_domain=ad_name,
+    shape=SHAPE,
+    source_details=oci.core.models.InstanceSourceViaImageDetails(
+        source_type="image",
+        image_id=win_image_id,
+        boot_volume_size_in_gbs=BOOT_VOL_GBS,
+    ),
+    shape_config=oci.core.models.LaunchInstanceShapeConfigDetails(
+        ocpus=OCPUS,
+        memory_in_gbs=MEMORY_GBS,
+    ),
+    create_vnic_details=oci.core.models.CreateVnicDetails(
+        subnet_id=subnet_id,
+        assign_public_ip=True
+    )
+)
+
+def provision(idx):
+    """
+    Launches one instance and blocks until it reaches the RUNNING state.
+    Uses a ComputeClient private to the calling thread.
+    idx: zero-based instance index
+    Returns: (display_name, instance_id)
+    Raises: RuntimeError naming the instance OCID if it launched but never
+    reached RUNNING, so the caller can report what was left behind
+    """
+    compute = oci.core.ComputeClient(load_config(), retry_strategy=oci.retry.DEFAULT_RETRY_STRATEGY)
     display_name = f"{INSTANCE_PREFIX}-{idx + 1}"
-    print(f"\nLaunching instance {idx+1}/{INSTANCE_COUNT}: {display_name}...")
+    write_lines([f"Launching instance {idx+1}/{INSTANCE_COUNT}: {display_name}..."])
 
-    # Define the instance launch details
-    launch_details = oci.core.models.LaunchInstanceDetails(
-        compartment_id=compartment_id,
-        availability_domain=ad_name,
-        shape=SHAPE,
-        display_name=display_name,
-        source_details=oci.core.models.InstanceSourceViaImageDetails(
-            source_type="image",
-            image_id=win_image_id,
-            boot_volume_size_in_gbs=BOOT_VOL_GBS,
-        ),
-        shape_config=oci.core.models.LaunchInstanceShapeConfigDetails(
-            ocpus=OCPUS,
-            memory_in_gbs=MEMORY_GBS,
-        ),
-        create_vnic_details=oci.core.models.CreateVnicDetails(
-            subnet_id=subnet_id,
-            assign_public_ip=True
-        )
-    )
+    # Only the display name differs between instances
+    launch_details = oci.core.models.LaunchInstanceDetails(display_name=display_name, **launch_template)
 
     # Launch the instance
-    resp = core.launch_instance(launch_details)
+    resp = compute.launch_instance(launch_details)
     instance_id = resp.data.id
-    print(f"Launched instance '{display_name}' (OCID: {instance_id})")
 
     # Wait for the instance to reach RUNNING state
-    print(f"Waiting for '{display_name}' to become RUNNING. This may take a few minutes...")
-    oci.wait_until(
-        core,
-        core.get_instance(instance_id),
-        'lifecycle_state',
-        'RUNNING',
-        max_wait_seconds=1800
-    )
-    print(f"Instance '{display_name}' is RUNNING.")
+    write_lines([
+        f"Launched instance '{display_name}' (OCID: {instance_id})",
+        f"Waiting for '{display_name}' to become RUNNING. This may take a few minutes..."
+    ])
+    # Seed the waiter with the launch response (it already carries the
+    # instance state) and let fetch_func do the polling GETs
+    try:
+        oci.wait_until(
+            compute,
+            resp,
+            'lifecycle_state',
+            'RUNNING',
+            max_wait_seconds=1800,
+            max_interval_seconds=15,
+            fetch_func=lambda response=None: compute.get_instance(instance_id)
+        )
+    except Exception as e:
+        raise RuntimeError(f"launched as {instance_id} but did not reach RUNNING: {e}") from e
+    write_lines([f"Instance '{display_name}' is RUNNING."])
+    return display_name, instance_id
+
+print(f"\nStep 6: Launching {INSTANCE_COUNT} Windows compute instances in compartment '{COMPARTMENT_NAME}'...")
+# One task per instance: each starts polling as soon as its own launch returns
+running, failed = [], []
+with ThreadPoolExecutor(max_workers=INSTANCE_COUNT) as pool:
+    futures = {pool.submit(provision, idx): f"{INSTANCE_PREFIX}-{idx + 1}" for idx in range(INSTANCE_COUNT)}
+    for future in as_completed(futures):
+        try:
+            running.append(future.result())
+        except Exception as e:
+            failed.append((futures[future], e))
+
+print(f"\n{len(running)}/{INSTANCE_COUNT} instance(s) reached RUNNING:")
+for display_name, instance_id in sorted(running):
+    print(f"  {display_name} (OCID: {instance_id})")
+if failed:
+    print(f"{len(failed)} instance(s) failed:")
+    for display_name, error in sorted(failed, key=lambda f: f[0]):
+        print(f"  {display_name}: {error}")
+    print(f"Instances that did launch are still in compartment '{COMPARTMENT_NAME}'. Exiting.")
+    exit(1)
 
-print("\nAll done! All Windows instances have been provisioned in the new compartment 'tempcomp'.")
+print(f"\nAll done! All Windows instances have been provisioned in the new compartment '{COMPARTMENT_NAME}'.")